@@ -167,6 +167,7 @@ with col2:
              st.write(f"**Prompt Instruction**: {selected_intent_obj['prompt_instruction']}")
 
 count = st.slider("Variations", min_value=1, max_value=10, value=1)
+force_refresh = st.checkbox("Force re-extraction (ignore cached facts)", value=False)
 
 if st.button("🚀 Execute rewrite workflow", type="primary"):
     if not original_text or not intent_input_for_extraction:
@@ -175,69 +176,88 @@ if st.button("🚀 Execute rewrite workflow", type="primary"):
         # Container for results
         results_container = st.container()
         
+        current_intent_id = selected_intent_obj['id'] if selected_intent_obj else None
+
         with st.status("Orchestrating Multi-Model Pipeline...", expanded=True) as status:
-            # Step 1
-            st.write("🔍 **Step 1: Understanding & Extraction** (DeepSeek-V3)")
-            try:
-                facts = rewriter.extract_facts(original_text, intent_input_for_extraction)
-                st.markdown(f"> **Facts Extracted:**\n> {facts[:100]}...")
-            except Exception as e:
-                st.error(f"Step 1 Failed: {e}")
-                st.stop()
+            with rewriter.tracer.span("run", variations=count, intent=current_intent_id or "custom"):
+                # Step 1
+                st.write("🔍 **Step 1: Understanding & Extraction** (DeepSeek-V3)")
+                try:
+                    facts = rewriter.extract_facts(original_text, intent_input_for_extraction, force_refresh=force_refresh)
+                    st.markdown(f"> **Facts Extracted:**\n> {facts[:100]}...")
+                except Exception as e:
+                    st.error(f"Step 1 Failed: {e}")
+                    st.stop()
                 
-            results = []
+                results = []
+                drafted = []
             
-            for i in range(count):
-                st.write(f"--- Processing Variation {i+1}/{count} ---")
+                # Variation spans stay open until Step 4 (run on a thread pool) has finished under them
+                variation_spans = []
+            
+                for i in range(count):
+                    variation_span = rewriter.tracer.detached_span("variation", index=i + 1)
+                    st.write(f"--- Processing Variation {i+1}/{count} ---")
                 
-                # Step 2
-                st.write("🎭 **Step 2: Persona Selection**")
-                # Determine intent ID for persona matching
-                current_intent_id = selected_intent_obj['id'] if selected_intent_obj else None
-                persona = rewriter.select_persona(intent_id=current_intent_id)
-                st.info(f"Selected: **{persona['name']}** ({persona['type']})")
+                    # Step 2
+                    st.write("🎭 **Step 2: Persona Selection**")
+                    persona = rewriter.select_persona(intent_id=current_intent_id)
+                    st.info(f"Selected: **{persona['name']}** ({persona['type']})")
                 
-                # Step 3
-                st.write("✍️ **Step 3: Role Generation** (Nous Hermes 3 -> Fallback: DeepSeek)")
-                try:
-                    draft = rewriter.generate_draft(persona, facts, intent_obj=selected_intent_obj)
-                except Exception as e:
-                    st.error(f"Generation Failed: {e}")
-                    continue
+                    # Step 3
+                    st.write("✍️ **Step 3: Role Generation** (Nous Hermes 3 -> Fallback: DeepSeek)")
+                    try:
+                        draft = variation_span.run(rewriter.generate_draft, persona, facts, intent_obj=selected_intent_obj)
+                    except Exception as e:
+                        variation_span.end(e)
+                        st.error(f"Generation Failed: {e}")
+                        continue
+
+                    drafted.append((persona, draft))
+                    variation_spans.append(variation_span)
 
-                # Step 4
+                # Step 4 (variations are gated concurrently so refinement rounds overlap)
                 st.write(f"🛡️ **Step 4: AI Detection & Refinement** ({s4_desc})")
-                final_output = rewriter.quality_gate(persona, draft)
-                
-                if "[REWRITTEN]" in final_output:
-                    final_content = final_output.replace("[REWRITTEN]", "").strip()
+                try:
+                    final_outputs = rewriter.quality_gate_batch(drafted, variation_spans)
+                finally:
+                    for variation_span in variation_spans:
+                        variation_span.end()
+
+                for (persona, draft), final_output in zip(drafted, final_outputs):
+                    tag, _, final_content = final_output.partition("]")
+                    tag = tag.lstrip("[")
+                    final_content = final_content.strip()
                     # Clean up score info if present (Matches both "(Score: XX)" and "(Scores: XX)")
-                    if "(Score" in final_content:
-                         # Extract content after scores
-                         parts = final_content.split(")", 1)
-                         if len(parts) > 1:
-                             final_content = parts[1].strip()
-                    
-                    status_label = "Refined/Rewritten"
-                    status_color = "orange"
-                else:
-                    final_content = final_output.replace("[PASSED]", "").strip()
-                    if "(Score" in final_content:
-                         parts = final_content.split(")", 1)
-                         if len(parts) > 1:
-                             final_content = parts[1].strip()
-                             
-                    status_label = "Passed Quality Gate"
-                    status_color = "green"
-                
-                results.append({
-                    "persona": persona,
-                    "draft": draft,
-                    "final": final_content,
-                    "status_label": status_label,
-                    "status_color": status_color,
-                    "raw_output": final_output
-                })
+                    if final_content.startswith("(Score"):
+                        parts = final_content.split(")", 1)
+                        if len(parts) > 1:
+                            final_content = parts[1].strip()
+
+                    if tag == "PASSED":
+                        status_label = "Passed Quality Gate"
+                        status_color = "green"
+                    elif tag == "REWRITTEN":
+                        status_label = "Refined/Rewritten"
+                        status_color = "orange"
+                    elif tag == "BUDGET_EXHAUSTED":
+                        # Best attempt, but still below the threshold
+                        status_label = "Failed: Refinement Budget Exhausted"
+                        status_color = "red"
+                    else:
+                        # [ERROR] or anything unexpected: never present it as passed
+                        final_content = draft
+                        status_label = "Failed: Quality Gate Error"
+                        status_color = "red"
+
+                    results.append({
+                        "persona": persona,
+                        "draft": draft,
+                        "final": final_content,
+                        "status_label": status_label,
+                        "status_color": status_color,
+                        "raw_output": final_output
+                    })
             
             status.update(label="Workflow Completed!", state="complete", expanded=False)
 
@@ -271,6 +291,18 @@ if st.button("🚀 Execute rewrite workflow", type="primary"):
             df = pd.DataFrame(logs)
             st.dataframe(df, use_container_width=True)
 
+            refinement_records = rewriter.get_refinement_records()
+            if refinement_records:
+                st.markdown("**Refinement Rounds (per Variation)**")
+                st.dataframe(pd.DataFrame(refinement_records), use_container_width=True)
+
+            st.markdown("**Critical Path (Trace Spans)**")
+            trace_rows = rewriter.get_trace_summary()
+            if trace_rows:
+                st.dataframe(pd.DataFrame(trace_rows), use_container_width=True)
+            else:
+                st.caption("No completed trace for this run.")
+
 
 
 
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+URL_PATTERN = re.compile(r"(https?://\S+|www\.\S+)", re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Zero-width joiner, variation selectors and keycap combiner glue emoji sequences together
+EMOJI_JOINERS = {"\u200d", "\ufe0e", "\ufe0f", "\u20e3"}
+
+SIGNATURE_BITS = 64
+SHINGLE_SIZE = 4
+
+# Amounts, percentages, dates, versions and cashtags; these must match exactly for facts to be reused
+NUMERIC_PATTERN = re.compile(r"[$€£¥]?\d[\d,.:/-]*(?:%|[kmb]n?\b|x\b)?|\$[a-z][a-z0-9]*")
+NUMBER_WORDS = {
+    "no", "none", "zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+    "eleven", "twelve", "twenty", "thirty", "fifty", "hundred", "thousand", "million", "billion", "trillion",
+    "jan", "january", "feb", "february", "mar", "march", "apr", "april", "may", "jun", "june", "jul", "july",
+    "aug", "august", "sep", "sept", "september", "oct", "october", "nov", "november", "dec", "december",
+    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday", "today", "tomorrow"
+}
+WORD_PATTERN = re.compile(r"[a-z]+")
+
+
+def normalize_text(text: str) -> str:
+    """Strip URLs and emoji, casefold and collapse whitespace"""
+    text = URL_PATTERN.sub(" ", text or "")
+    text = unicodedata.normalize("NFKC", text)
+
+    chars = []
+    for ch in text:
+        if ch in EMOJI_JOINERS:
+            continue
+        # So/Sk cover emoji and pictographs; Cf covers invisible formatting marks
+        if unicodedata.category(ch) in ("So", "Sk", "Cf"):
+            continue
+        chars.append(ch)
+
+    text = "".join(chars).casefold()
+    return WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+def _shingles(text: str) -> List[str]:
+    if len(text) <= SHINGLE_SIZE:
+        return [text] if text else []
+    return [text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)]
+
+
+def compute_signature(normalized_text: str) -> int:
+    """64-bit SimHash over character shingles (works for both English and CJK text)"""
+    weights = [0] * SIGNATURE_BITS
+    for shingle in _shingles(normalized_text):
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIGNATURE_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+
+    signature = 0
+    for bit in range(SIGNATURE_BITS):
+        if weights[bit] > 0:
+            signature |= 1 << bit
+    return signature
+
+
+def fact_tokens_hash(normalized_text: str) -> str:
+    """Hash of the numeric / date tokens, which SimHash is too coarse to tell apart"""
+    tokens = NUMERIC_PATTERN.findall(normalized_text)
+    tokens += [w for w in WORD_PATTERN.findall(normalized_text) if w in NUMBER_WORDS]
+    return hashlib.sha256("\x1f".join(sorted(tokens)).encode("utf-8")).hexdigest()
+
+
+def similarity(sig_a: int, sig_b: int) -> float:
+    """Fraction of matching signature bits (1.0 = identical)"""
+    return 1.0 - bin(sig_a ^ sig_b).count("1") / SIGNATURE_BITS
+
+
+class FactIndex:
+    """Local JSON-backed index of prior Step 1 extractions keyed by input fingerprint"""
+    def __init__(self, path: str, similarity_threshold: float = 0.95, max_entries: int = 500):
+        self.path = path
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.entries = self._load()
+
+    def _load(self) -> List[Dict]:
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except (json.JSONDecodeError, OSError):
+                return []
+        return []
+
+    def save(self):
+        # Write to a temp file and swap it in, so a crash or a concurrent save never leaves a truncated index
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".fact_index.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _intent_key(intent: str) -> str:
+        return normalize_text(intent)
+
+    def lookup(self, original_text: str, intent: str) -> Optional[Dict]:
+        """Return the closest stored extraction for the same intent, or None below threshold"""
+        normalized = normalize_text(original_text)
+        text_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        intent_key = self._intent_key(intent)
+        signature = compute_signature(normalized)
+        tokens_hash = fact_tokens_hash(normalized)
+
+        best = None
+        best_score = 0.0
+        for entry in self.entries:
+            if entry["intent"] != intent_key:
+                continue
+            if entry["text_hash"] == text_hash:
+                return {**entry, "similarity": 1.0}
+            # A changed amount or date means the stored facts are stale, however similar the prose
+            if entry.get("tokens_hash") != tokens_hash:
+                continue
+            score = similarity(signature, int(entry["signature"], 16))
+            if score > best_score:
+                best, best_score = entry, score
+
+        if best and best_score >= self.similarity_threshold:
+            return {**best, "similarity": best_score}
+        return None
+
+    def add(self, original_text: str, intent: str, facts: str):
+        normalized = normalize_text(original_text)
+        text_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        intent_key = self._intent_key(intent)
+
+        # Replace any previous extraction for the exact same normalized input
+        self.entries = [e for e in self.entries if not (e["text_hash"] == text_hash and e["intent"] == intent_key)]
+        self.entries.append({
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "intent": intent_key,
+            "text_hash": text_hash,
+            "signature": f"{compute_signature(normalized):016x}",
+            "tokens_hash": fact_tokens_hash(normalized),
+            "facts": facts
+        })
+        if len(self.entries) > self.max_entries:
+            self.entries = self.entries[-self.max_entries:]
+        self.save()
@@ -0,0 +1,90 @@
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+# Add parent directory to path to allow importing src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.workflow import TweetRewriter
+
+
+def run_job(rewriter: TweetRewriter, original_text: str, intent: str) -> Dict:
+    """One pipeline pass (Step 1 -> 4) for a single variation"""
+    start = time.time()
+    with rewriter.tracer.span("run", variations=1, intent=intent):
+        try:
+            facts = rewriter.extract_facts(original_text, intent)
+            with rewriter.tracer.span("variation", index=1):
+                persona = rewriter.select_persona()
+                draft = rewriter.generate_draft(persona, facts)
+                output = rewriter.quality_gate(persona, draft)
+            outcome = output.split("]", 1)[0].lstrip("[") if output.startswith("[") else "UNKNOWN"
+        except Exception as e:
+            outcome = f"FAILED: {type(e).__name__}"
+    return {"latency": time.time() - start, "outcome": outcome}
+
+
+def run_load_test(config: Dict, original_text: str, intent: str, jobs: int, multiplier: float) -> Dict:
+    """Drive the pipeline from a replay cassette at `multiplier` x the recorded peak concurrency"""
+    config = {**config}
+    config.setdefault("transport", {})["mode"] = "replay"
+    # Near-duplicate reuse would short-circuit Step 1 on every job after the first
+    config.setdefault("step1_extraction", {}).setdefault("fingerprint", {})["enabled"] = False
+    config.setdefault("tracing", {})["enabled"] = False
+
+    rewriter = TweetRewriter(config)
+    workers = max(1, math.ceil(rewriter.transport.peak_concurrency() * multiplier))
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda _: run_job(rewriter, original_text, intent), range(jobs)))
+    elapsed = time.time() - start
+
+    latencies = sorted(r["latency"] for r in results)
+    return {
+        "jobs": jobs,
+        "workers": workers,
+        "elapsed": round(elapsed, 3),
+        "throughput": round(jobs / elapsed, 2) if elapsed else None,
+        "p50": round(latencies[len(latencies) // 2], 3) if latencies else None,
+        "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3) if latencies else None,
+        "outcomes": dict(Counter(r["outcome"] for r in results))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded cassette through the rewrite pipeline")
+    parser.add_argument("--cassette", type=str, required=True, help="Cassette recorded with transport.mode = record")
+    parser.add_argument("--text", type=str, required=True, help="The original tweet text")
+    parser.add_argument("--intent", type=str, required=True, help="The rewrite intent")
+    parser.add_argument("--jobs", type=int, default=100, help="Number of pipeline runs")
+    parser.add_argument("--multiplier", type=float, default=1.0, help="Concurrency as a multiple of the recorded peak")
+    parser.add_argument("--timing", choices=["none", "original", "scaled"], default="none", help="Replay latency mode")
+    parser.add_argument("--time_scale", type=float, default=1.0, help="Latency factor for --timing scaled")
+    parser.add_argument("--config", type=str, help="Pipeline config JSON (models must match the recording)")
+
+    args = parser.parse_args()
+
+    config = {}
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    config["transport"] = {
+        "mode": "replay",
+        "cassette_path": args.cassette,
+        "timing": args.timing,
+        "time_scale": args.time_scale
+    }
+
+    report = run_load_test(config, args.text, args.intent, args.jobs, args.multiplier)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
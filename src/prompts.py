@@ -69,6 +69,10 @@ OUTPUT REQUIREMENTS:
 - Form: Output ONLY the tweet text. No quotes, no prefixes, no explanations.
 """
 
+# Hard deductions in QUALITY_GATE_JSON_PROMPT, also checked locally so failing candidates skip scoring
+BANNED_WORDS = ["revolutionize", "unleash", "realm", "tapestry", "delve", "landscape", "testament", "vibrant", "elevate", "game-changer"]
+GENERIC_HASHTAGS = ["#crypto", "#blockchain"]
+
 QUALITY_GATE_PROMPT = """
 Please review the generated tweet for human-like style. Prefer QUALITY_GATE_JSON_PROMPT in new workflows.
 """
@@ -112,3 +116,31 @@ CRITICAL:
 - Output VALID JSON only.
 - Do NOT wrap JSON in markdown fences or any extra text.
 """
+
+QUALITY_GATE_REWRITE_PROMPT = """
+You are a "Crypto Twitter Editor". The tweet below already failed automatic checks, so do NOT score it; just fix it.
+
+Persona:
+Name: {persona_name}
+Description: {persona_description}
+
+Tweet to Fix:
+"{draft_tweet}"
+
+Problems Found:
+{reasons}
+
+Rewrite it so it sounds 100% human and matches the persona:
+- Fix every problem above; keep all facts, numbers and links.
+- None of these words: "Revolutionize", "Unleash", "realm", "tapestry", "delve", "landscape", "testament", "vibrant", "elevate", "game-changer".
+- No generic hashtags (#Crypto, #Blockchain). English only, short tweet style.
+
+Output Format (JSON ONLY):
+{{
+  "rewritten_tweet": "<the fixed tweet, never empty>"
+}}
+
+CRITICAL:
+- Output VALID JSON only.
+- Do NOT wrap JSON in markdown fences or any extra text.
+"""
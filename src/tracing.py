@@ -0,0 +1,246 @@
+import contextvars
+import functools
+import json
+import os
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+# Active span for the current thread / task; copy the context when handing work to a pool
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def current_span() -> Optional["Span"]:
+    return _current_span.get()
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent: Optional["Span"] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent = parent
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = STATUS_UNSET
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_status(self, code: int, message: str = ""):
+        self.status = code
+        self.status_message = message
+
+    @property
+    def duration(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e9
+
+    def to_otlp(self) -> Dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": self.status, "message": self.status_message}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Tracer:
+    """Collects nested spans (run -> variation -> step -> attempt) and exports finished traces"""
+    def __init__(self, export_path: Optional[str] = None, endpoint: Optional[str] = None, service_name: str = "tweet-rewriter", max_runs: int = 20):
+        self.export_path = export_path
+        self.endpoint = endpoint
+        self.service_name = service_name
+        # Spans grouped by trace; only the last `max_runs` finished traces are kept after export
+        self.max_runs = max_runs
+        self.traces: Dict[str, List[Span]] = {}
+        self.finished: List[str] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        parent = _current_span.get()
+        trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        span = Span(name, trace_id, parent, attributes)
+        with self._lock:
+            self.traces.setdefault(trace_id, []).append(span)
+
+        token = _current_span.set(span)
+        try:
+            yield span
+            if span.status == STATUS_UNSET:
+                span.set_status(STATUS_OK)
+        except Exception as e:
+            span.set_status(STATUS_ERROR, str(e))
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            # Root span closed: the trace is complete
+            if parent is None:
+                self.export(trace_id)
+                self._retire(trace_id)
+
+    def _retire(self, trace_id: str):
+        with self._lock:
+            self.finished.append(trace_id)
+            while len(self.finished) > self.max_runs:
+                self.traces.pop(self.finished.pop(0), None)
+
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def detached_span(self, name: str, **attributes) -> "DetachedSpan":
+        return DetachedSpan(self, name, **attributes)
+
+    def get_trace(self, trace_id: str) -> List[Span]:
+        with self._lock:
+            return list(self.traces.get(trace_id, []))
+
+    def get_runs(self) -> List[Span]:
+        """Root spans of the retained finished traces, oldest first"""
+        with self._lock:
+            return [self.traces[t][0] for t in self.finished if t in self.traces]
+
+    def export(self, trace_id: str):
+        if not self.export_path and not self.endpoint:
+            return
+
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": "src.tracing"},
+                    "spans": [s.to_otlp() for s in self.get_trace(trace_id)]
+                }]
+            }]
+        }
+
+        if self.export_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.export_path)), exist_ok=True)
+                with open(self.export_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"Trace export to file failed: {e}")
+
+        if self.endpoint:
+            # OTLP/HTTP JSON, e.g. http://localhost:4318/v1/traces
+            try:
+                request = urllib.request.Request(
+                    self.endpoint,
+                    data=json.dumps(payload).encode("utf-8"),
+                    headers={"Content-Type": "application/json"},
+                    method="POST"
+                )
+                urllib.request.urlopen(request, timeout=5).close()
+            except Exception as e:
+                print(f"Trace export to collector failed: {e}")
+
+    def critical_path(self, root: Span) -> List[Tuple[int, Span, float]]:
+        """Chain of spans that determined the run's wall time, as (depth, span, seconds on the path).
+
+        Siblings may overlap (e.g. variations gated concurrently), so each span is only credited
+        with the part of it that lies before the point where the next span on the path took over.
+        """
+        spans = self.get_trace(root.trace_id)
+        children: Dict[str, List[Span]] = {}
+        for s in spans:
+            if s.parent_id and s.end_ns is not None:
+                children.setdefault(s.parent_id, []).append(s)
+
+        path: List[Tuple[int, Span, float]] = []
+
+        def walk(span: Span, depth: int, window_start: int, window_end: int):
+            path.append((depth, span, (window_end - window_start) / 1e9))
+            # Walk backwards from the end of the window: at each point, the child that was still
+            # running latest (clipped to the cursor) is the one the parent was waiting on
+            chain = []
+            cursor = window_end
+            while True:
+                candidates = [c for c in children.get(span.span_id, []) if window_start <= c.start_ns < cursor]
+                if not candidates:
+                    break
+                child = max(candidates, key=lambda c: (min(c.end_ns, cursor), c.start_ns))
+                chain.append((child, min(child.end_ns, cursor)))
+                cursor = child.start_ns
+            for child, child_end in reversed(chain):
+                walk(child, depth + 1, child.start_ns, child_end)
+
+        walk(root, 0, root.start_ns, root.end_ns if root.end_ns is not None else time.time_ns())
+        return path
+
+    def summarize_run(self, root: Span) -> List[Dict]:
+        """Critical path rows for display (e.g. in the Streamlit audit expander)"""
+        rows = []
+        for depth, span, on_path in self.critical_path(root):
+            rows.append({
+                "span": "  " * depth + span.name,
+                "duration": f"{span.duration:.2f}s",
+                "on_path": f"{on_path:.2f}s",
+                "share": f"{on_path / root.duration * 100:.0f}%" if root.duration else "-",
+                "status": {STATUS_OK: "OK", STATUS_ERROR: "ERROR"}.get(span.status, "UNSET"),
+                "attributes": ", ".join(f"{k}={v}" for k, v in span.attributes.items())
+            })
+        return rows
+
+
+class DetachedSpan:
+    """A span opened in its own copy of the current context, so work can run under it later
+    (e.g. on a pool thread) and it can be ended once that work is done"""
+    def __init__(self, tracer: Tracer, name: str, **attributes):
+        self.context = contextvars.copy_context()
+        self._cm = tracer.span(name, **attributes)
+        self.span = self.context.run(self._cm.__enter__)
+        self.ended = False
+
+    def run(self, func, *args, **kwargs):
+        # A context can only be entered by one thread at a time; run one task per span at once
+        return self.context.run(func, *args, **kwargs)
+
+    def end(self, error: Optional[Exception] = None):
+        """End the span; later calls are no-ops"""
+        if self.ended:
+            return
+        self.ended = True
+        if error is not None:
+            self.span.set_status(STATUS_ERROR, str(error))
+        self.context.run(self._cm.__exit__, None, None, None)
+
+
+def traced_step(name: str):
+    """Wrap a TweetRewriter step method in a span on self.tracer"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.tracer.span(name, step=func.__name__):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
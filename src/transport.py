@@ -0,0 +1,235 @@
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: batches are still single appends, just without the cross-process lock
+    fcntl = None
+
+from src.tracing import current_span
+
+# (content, usage attributes)
+TransportResult = Tuple[str, Dict[str, int]]
+
+
+def request_key(provider: str, model: str, system_instruction: str, prompt: str, json_mode: bool) -> str:
+    raw = json.dumps([provider, model, system_instruction, prompt, json_mode], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def lane_key(step: str, model: str, json_mode: bool) -> str:
+    """Coarse key used when a replayed prompt differs from the recorded one (e.g. random persona)"""
+    return f"{step}|{model}|{int(json_mode)}"
+
+
+def current_step_name() -> str:
+    """Name of the enclosing pipeline step span ("Step 1", "Step 3", ...), or "" outside a step"""
+    span = current_span()
+    while span and not span.name.startswith("Step "):
+        span = span.parent
+    return span.name if span else ""
+
+
+class ReplayMiss(Exception):
+    pass
+
+
+class Cassette:
+    """Compact JSON-lines file of recorded LLM interactions (gzip if the path ends in .gz).
+
+    Records are buffered and appended in batches; with gzip each batch becomes one compressed
+    member, so compression works across records. A batch is written with a single append under
+    an exclusive file lock, so several recording processes can share one cassette.
+    """
+    def __init__(self, path: str, batch_size: int = 200, flush_interval: float = 5.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: List[str] = []
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_path(cls, path: str) -> "Cassette":
+        """One shared writer per cassette path in this process"""
+        key = os.path.abspath(path)
+        with _cassettes_lock:
+            if key not in _cassettes:
+                _cassettes[key] = cls(path)
+            return _cassettes[key]
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def load(self) -> List[Dict]:
+        if not os.path.exists(self.path):
+            return []
+        # Concatenated gzip members read back as one stream
+        with self._open("r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def append(self, interaction: Dict):
+        with self._lock:
+            self._buffer.append(json.dumps(interaction, ensure_ascii=False, separators=(",", ":")) + "\n")
+            due = len(self._buffer) >= self.batch_size or time.time() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._buffer:
+                return
+            data = "".join(self._buffer).encode("utf-8")
+            self._buffer = []
+            self._last_flush = time.time()
+
+            if self.path.endswith(".gz"):
+                data = gzip.compress(data)
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "ab") as f:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.write(data)
+                    f.flush()
+                finally:
+                    if fcntl:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+_cassettes: Dict[str, Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+
+@atexit.register
+def _flush_cassettes():
+    for cassette in list(_cassettes.values()):
+        cassette.flush()
+
+
+class LiveTransport:
+    """Sends requests straight to the provider SDK"""
+    offline = False
+
+    def send(self, client: Any, prompt: str, system_instruction: str, json_mode: bool) -> TransportResult:
+        response, content = client._call_provider(prompt, system_instruction, json_mode)
+        return content, client._usage_attributes(response)
+
+    def backoff(self, seconds: float):
+        time.sleep(seconds)
+
+
+class RecordingTransport(LiveTransport):
+    """Live transport that also writes each request/response (or error) to a cassette"""
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    def send(self, client: Any, prompt: str, system_instruction: str, json_mode: bool) -> TransportResult:
+        step = current_step_name()
+        interaction = {
+            "k": request_key(client.provider, client.model_name, system_instruction, prompt, json_mode),
+            "l": lane_key(step, client.model_name, json_mode),
+            "p": client.provider,
+            "m": client.model_name,
+            "j": int(json_mode),
+            "s": step,
+            # Absolute start time, so sessions recorded by different transports don't appear to overlap
+            "t0": round(time.time(), 4)
+        }
+        start = time.time()
+        try:
+            content, usage = super().send(client, prompt, system_instruction, json_mode)
+            interaction.update({"d": round(time.time() - start, 4), "r": content, "u": usage})
+            return content, usage
+        except Exception as e:
+            interaction.update({"d": round(time.time() - start, 4), "e": str(e)})
+            raise
+        finally:
+            self.cassette.append(interaction)
+
+
+class ReplayTransport:
+    """Serves recorded responses offline; recorded errors are re-raised so fallback paths replay too"""
+    offline = True
+
+    def __init__(self, cassette: Cassette, timing: str = "none", time_scale: float = 1.0):
+        if timing not in ("none", "original", "scaled"):
+            raise ValueError(f"Unknown replay timing: {timing}")
+        self.timing = timing
+        self.time_scale = time_scale if timing == "scaled" else 1.0
+        self.interactions = cassette.load()
+        self._lock = threading.Lock()
+
+        # Index once so lookups stay O(1) however many calls are replayed
+        self._by_key: Dict[str, List[Dict]] = {}
+        self._by_lane: Dict[str, List[Dict]] = {}
+        for interaction in self.interactions:
+            self._by_key.setdefault(interaction["k"], []).append(interaction)
+            self._by_lane.setdefault(interaction["l"], []).append(interaction)
+        self._cursors: Dict[str, int] = {}
+
+    def _next(self, index: Dict[str, List[Dict]], key: str) -> Optional[Dict]:
+        candidates = index.get(key)
+        if not candidates:
+            return None
+        with self._lock:
+            # Round-robin in recorded order; wraps so a short cassette can drive a long load test
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+        return candidates[cursor % len(candidates)]
+
+    def _sleep(self, seconds: float):
+        if self.timing != "none" and seconds > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def send(self, client: Any, prompt: str, system_instruction: str, json_mode: bool) -> TransportResult:
+        key = request_key(client.provider, client.model_name, system_instruction, prompt, json_mode)
+        step = current_step_name()
+        interaction = self._next(self._by_key, key) or self._next(self._by_lane, lane_key(step, client.model_name, json_mode))
+        if interaction is None:
+            raise ReplayMiss(f"No recorded interaction for {step or 'request'} on model {client.model_name}")
+
+        self._sleep(interaction.get("d", 0))
+        if "e" in interaction:
+            raise RuntimeError(interaction["e"])
+        return interaction["r"], interaction.get("u", {})
+
+    def backoff(self, seconds: float):
+        self._sleep(seconds)
+
+    def peak_concurrency(self) -> int:
+        """Maximum number of overlapping calls in the recording"""
+        events = []
+        for interaction in self.interactions:
+            start = interaction.get("t0", 0)
+            events.append((start, 1))
+            events.append((start + interaction.get("d", 0), -1))
+        # Ends sort before starts at the same instant
+        events.sort(key=lambda e: (e[0], e[1]))
+        peak = current = 0
+        for _, delta in events:
+            current += delta
+            peak = max(peak, current)
+        return max(peak, 1)
+
+
+def create_transport(transport_config: Dict):
+    mode = transport_config.get("mode", "live")
+    if mode == "live":
+        return LiveTransport()
+
+    cassette_path = transport_config.get("cassette_path") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "cassette.jsonl.gz")
+    cassette = Cassette.for_path(cassette_path)
+    if mode == "record":
+        return RecordingTransport(cassette)
+    if mode == "replay":
+        return ReplayTransport(cassette, timing=transport_config.get("timing", "none"), time_scale=transport_config.get("time_scale", 1.0))
+    raise ValueError(f"Unknown transport mode: {mode}")
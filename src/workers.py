@@ -0,0 +1,393 @@
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# Add parent directory to path to allow importing src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.transport import TransportResult, current_step_name, request_key
+from src.workflow import TweetRewriter
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workers.db")
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    # Autocommit mode; writers take explicit BEGIN IMMEDIATE locks
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            worker TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            created REAL NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id);
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            content TEXT NOT NULL,
+            usage TEXT NOT NULL,
+            created REAL NOT NULL
+        );
+    """)
+    return conn
+
+
+class ThreadLocalConnection:
+    """One SQLite connection per thread (sqlite3 connections must stay on the thread that opened them)"""
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.db_path)
+        return conn
+
+
+class JobQueue:
+    """SQLite-backed job queue shared by all worker processes"""
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, max_attempts: int = 3):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.conn = connect(db_path)
+
+    def enqueue(self, payload: Dict) -> int:
+        now = time.time()
+        cur = self.conn.execute(
+            "INSERT INTO jobs (payload, created, updated) VALUES (?, ?, ?)",
+            (json.dumps(payload, ensure_ascii=False), now, now)
+        )
+        return cur.lastrowid
+
+    def claim(self, worker: str) -> Optional[Dict]:
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT id, payload FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if not row:
+                self.conn.execute("COMMIT")
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                (worker, time.time(), row[0])
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return {"id": row[0], "payload": json.loads(row[1])}
+
+    def complete(self, job_id: int, result: Any):
+        self.conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, updated = ? WHERE id = ?",
+            (json.dumps(result, ensure_ascii=False), time.time(), job_id)
+        )
+
+    def fail(self, job_id: int, error: str):
+        # Retry until max_attempts, then park the job as failed
+        self.conn.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, result = ?, worker = NULL, updated = ? WHERE id = ?",
+            (self.max_attempts, json.dumps({"error": error}), time.time(), job_id)
+        )
+
+    def requeue_worker(self, worker: str) -> int:
+        """Return a dead worker's in-flight jobs to the queue (jobs out of attempts are parked as failed)"""
+        cur = self.conn.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, result = ?, worker = NULL, updated = ? WHERE status = 'running' AND worker = ?",
+            (self.max_attempts, json.dumps({"error": f"{worker} died while running this job"}), time.time(), worker)
+        )
+        return cur.rowcount
+
+    def requeue_stale(self) -> int:
+        """Recover jobs left 'running' by a previous supervisor that died; call before any worker starts"""
+        cur = self.conn.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, result = ?, worker = NULL, updated = ? WHERE status = 'running'",
+            (self.max_attempts, json.dumps({"error": "Supervisor stopped while running this job"}), time.time())
+        )
+        return cur.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+class SharedRateLimiter:
+    """Token bucket per provider/model kept in SQLite so all workers share one quota"""
+    def __init__(self, connections: ThreadLocalConnection, limits: Dict[str, float]):
+        self.connections = connections
+        # Requests per minute, keyed by model name or provider
+        self.limits = limits
+
+    def _limit_for(self, provider: str, model: str):
+        if model in self.limits:
+            return model, self.limits[model]
+        if provider in self.limits:
+            return provider, self.limits[provider]
+        return None, None
+
+    def acquire(self, provider: str, model: str):
+        key, rpm = self._limit_for(provider, model)
+        if not key:
+            return
+
+        rate = rpm / 60.0
+        conn = self.connections.get()
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = conn.execute("SELECT tokens, updated FROM rate_limits WHERE key = ?", (key,)).fetchone()
+                tokens = rpm if row is None else min(rpm, row[0] + (now - row[1]) * rate)
+                granted = tokens >= 1
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (key, tokens, updated) VALUES (?, ?, ?)",
+                    (key, tokens - 1 if granted else tokens, now)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if granted:
+                return
+            time.sleep((1 - tokens) / rate)
+
+
+class SharedStateTransport:
+    """Wraps a live transport with the cross-process rate limiter and response cache"""
+    def __init__(self, inner: Any, connections: ThreadLocalConnection, limiter: SharedRateLimiter, cache_steps: List[str]):
+        self.inner = inner
+        self.offline = inner.offline
+        # Step 4 runs on quality_gate_batch's thread pool, so every thread needs its own connection
+        self.connections = connections
+        self.limiter = limiter
+        self.cache_steps = set(cache_steps)
+
+    def send(self, client: Any, prompt: str, system_instruction: str, json_mode: bool) -> TransportResult:
+        cacheable = current_step_name() in self.cache_steps
+        key = request_key(client.provider, client.model_name, system_instruction, prompt, json_mode)
+
+        if cacheable:
+            row = self.connections.get().execute("SELECT content, usage FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if row:
+                return row[0], {}
+
+        self.limiter.acquire(client.provider, client.model_name)
+        content, usage = self.inner.send(client, prompt, system_instruction, json_mode)
+
+        if cacheable:
+            self.connections.get().execute(
+                "INSERT OR REPLACE INTO response_cache (key, content, usage, created) VALUES (?, ?, ?, ?)",
+                (key, content, json.dumps(usage), time.time())
+            )
+        return content, usage
+
+    def backoff(self, seconds: float):
+        self.inner.backoff(seconds)
+
+
+def process_job(rewriter: TweetRewriter, payload: Dict) -> List[Dict]:
+    """Same pipeline as the Streamlit app: one extraction, then `count` variations"""
+    intent_id = payload.get("intent_id")
+    intent_obj = next((i for i in rewriter.get_intents() if i["id"] == intent_id), None) if intent_id else None
+    intent = payload.get("intent") or (f"{intent_obj['label']} - {intent_obj['core_logic']}" if intent_obj else "")
+    count = payload.get("count", 1)
+
+    results: List[Optional[Dict]] = [None] * count
+    with rewriter.tracer.span("run", variations=count, intent=intent_id or "custom"):
+        facts = rewriter.extract_facts(payload["original_text"], intent)
+        drafted = []
+        drafted_indices = []
+        # Variation spans stay open until Step 4 (run on a thread pool) has finished under them
+        variation_spans = []
+        try:
+            for i in range(count):
+                span = rewriter.tracer.detached_span("variation", index=i + 1)
+                persona = rewriter.select_persona(intent_id=intent_id)
+                try:
+                    draft = span.run(rewriter.generate_draft, persona, facts, intent_obj=intent_obj)
+                except Exception as e:
+                    # Like the app: record the failed variation and keep the rest, so a retry doesn't re-bill them
+                    span.end(e)
+                    results[i] = {"persona": persona["name"], "error": str(e)}
+                    continue
+                drafted.append((persona, draft))
+                drafted_indices.append(i)
+                variation_spans.append(span)
+            for i, (persona, draft), final in zip(drafted_indices, drafted, rewriter.quality_gate_batch(drafted, variation_spans)):
+                results[i] = {"persona": persona["name"], "draft": draft, "final": final}
+        finally:
+            for span in variation_spans:
+                span.end()
+    return results
+
+
+def worker_loop(worker: str, config: Dict, db_path: str, stop_event: Any, exit_when_empty: bool, poll_interval: float):
+    # The supervisor handles signals; workers only watch stop_event so in-flight jobs finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    worker_config = config.get("workers", {})
+    queue = JobQueue(db_path, max_attempts=worker_config.get("max_attempts", 3))
+    rewriter = TweetRewriter(config)
+    connections = ThreadLocalConnection(db_path)
+    limiter = SharedRateLimiter(connections, worker_config.get("rate_limits", {}))
+    rewriter.transport = SharedStateTransport(rewriter.transport, connections, limiter, worker_config.get("cache_steps", ["Step 1"]))
+
+    while not stop_event.is_set():
+        job = queue.claim(worker)
+        if not job:
+            if exit_when_empty:
+                return
+            time.sleep(poll_interval)
+            continue
+        try:
+            queue.complete(job["id"], process_job(rewriter, job["payload"]))
+        except Exception as e:
+            queue.fail(job["id"], str(e))
+
+
+class Supervisor:
+    """Runs N worker processes; restarts crashed workers and drains gracefully on SIGINT/SIGTERM
+
+    Assumes it is the only supervisor on the database: jobs still 'running' at startup are recovered.
+    """
+    RESTART_BACKOFF = 1.0
+    RESTART_BACKOFF_MAX = 60.0
+    # A worker that stayed up this long is considered healthy again
+    HEALTHY_UPTIME = 60.0
+
+    def __init__(self, config: Dict, num_workers: int, db_path: str = DEFAULT_DB_PATH, exit_when_empty: bool = False, poll_interval: float = 0.5):
+        self.config = config
+        self.num_workers = num_workers
+        self.db_path = db_path
+        self.exit_when_empty = exit_when_empty
+        self.poll_interval = poll_interval
+        self.ctx = multiprocessing.get_context("spawn")
+        self.stop_event = self.ctx.Event()
+        self.processes: Dict[str, Any] = {}
+        self.started_at: Dict[str, float] = {}
+        self.crashes: Dict[str, int] = {}
+        self.restart_at: Dict[str, float] = {}
+        self.queue = JobQueue(db_path, max_attempts=config.get("workers", {}).get("max_attempts", 3))
+
+    def _start(self, worker: str):
+        process = self.ctx.Process(
+            target=worker_loop,
+            args=(worker, self.config, self.db_path, self.stop_event, self.exit_when_empty, self.poll_interval),
+            name=worker
+        )
+        process.start()
+        self.processes[worker] = process
+        self.started_at[worker] = time.time()
+
+    def drain(self, *_):
+        print("Draining: workers will exit after their current job...")
+        self.stop_event.set()
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.drain)
+        signal.signal(signal.SIGTERM, self.drain)
+
+        recovered = self.queue.requeue_stale()
+        if recovered:
+            print(f"Recovered {recovered} job(s) left running by a previous supervisor")
+
+        for n in range(self.num_workers):
+            self._start(f"worker-{n + 1}")
+
+        while self.processes or (self.restart_at and not self.stop_event.is_set()):
+            time.sleep(self.poll_interval)
+            for worker, process in list(self.processes.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                del self.processes[worker]
+                if process.exitcode != 0:
+                    requeued = self.queue.requeue_worker(worker)
+                    if self.stop_event.is_set():
+                        print(f"{worker} exited with code {process.exitcode}; requeued {requeued} job(s)")
+                        continue
+                    if time.time() - self.started_at[worker] >= self.HEALTHY_UPTIME:
+                        self.crashes[worker] = 0
+                    self.crashes[worker] = self.crashes.get(worker, 0) + 1
+                    delay = min(self.RESTART_BACKOFF_MAX, self.RESTART_BACKOFF * 2 ** (self.crashes[worker] - 1))
+                    print(f"{worker} exited with code {process.exitcode}; requeued {requeued} job(s), restarting in {delay:.0f}s")
+                    self.restart_at[worker] = time.time() + delay
+
+            for worker, due in list(self.restart_at.items()):
+                if self.stop_event.is_set():
+                    self.restart_at.clear()
+                elif time.time() >= due:
+                    del self.restart_at[worker]
+                    self._start(worker)
+
+        return self.queue.counts()
+
+
+def load_config(path: str) -> Dict:
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-process rewrite workers backed by a SQLite queue")
+    parser.add_argument("--db", type=str, default=DEFAULT_DB_PATH, help="Shared queue / rate-limit / cache database")
+    parser.add_argument("--config", type=str, default=CONFIG_PATH, help="Pipeline config JSON")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = sub.add_parser("enqueue", help="Add a rewrite job")
+    enqueue.add_argument("--text", type=str, required=True, help="The original tweet text")
+    enqueue.add_argument("--intent", type=str, help="Custom rewrite intent")
+    enqueue.add_argument("--intent_id", type=str, help="Intent id from intents.json (e.g. 'degen')")
+    enqueue.add_argument("--count", type=int, default=1, help="Number of variations to generate")
+
+    run = sub.add_parser("run", help="Start the supervisor")
+    run.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    run.add_argument("--exit-when-empty", action="store_true", help="Stop once the queue is drained")
+
+    sub.add_parser("status", help="Show job counts by status")
+
+    args = parser.parse_args()
+
+    if args.command == "enqueue":
+        if not args.intent and not args.intent_id:
+            parser.error("enqueue needs --intent or --intent_id")
+        job_id = JobQueue(args.db).enqueue({
+            "original_text": args.text,
+            "intent": args.intent,
+            "intent_id": args.intent_id,
+            "count": args.count
+        })
+        print(f"Enqueued job {job_id}")
+    elif args.command == "run":
+        config = load_config(args.config)
+        # The JSON fact index is per-process; the shared response cache covers Step 1 instead
+        config.setdefault("step1_extraction", {}).setdefault("fingerprint", {})["enabled"] = False
+        counts = Supervisor(config, args.workers, db_path=args.db, exit_when_empty=args.exit_when_empty).run()
+        print(json.dumps(counts, indent=2))
+    else:
+        print(json.dumps(JobQueue(args.db).counts(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
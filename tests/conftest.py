@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Add repo root to path to allow importing src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
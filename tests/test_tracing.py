@@ -0,0 +1,52 @@
+from src.tracing import Span, Tracer
+
+SECOND = 1_000_000_000
+
+
+def _span(tracer, name, parent, start, end):
+    span = Span(name, parent.trace_id if parent else "trace", parent)
+    span.start_ns, span.end_ns = start * SECOND, end * SECOND
+    tracer.traces.setdefault(span.trace_id, []).append(span)
+    return span
+
+
+def _overlapping_run(tracer):
+    """Step 1, then three sequential drafts, then all Step 4 gates at once (as the app runs them)"""
+    run = _span(tracer, "run", None, 0, 5)
+    _span(tracer, "Step 1", run, 0, 1)
+    for i in range(3):
+        variation = _span(tracer, "variation", run, 1 + i, 5)
+        _span(tracer, "Step 3", variation, 1 + i, 2 + i)
+        _span(tracer, "Step 4", variation, 4, 5)
+    return run
+
+
+def test_critical_path_covers_wall_time_with_overlapping_variations():
+    tracer = Tracer()
+    run = _overlapping_run(tracer)
+
+    path = tracer.critical_path(run)
+    top_level = [(span, on_path) for depth, span, on_path in path if depth == 1]
+
+    assert sum(on_path for _, on_path in top_level) == run.duration
+    assert [s.name for s, _ in top_level] == ["Step 1", "variation", "variation", "variation"]
+
+
+def test_critical_path_follows_each_draft_then_the_last_gate():
+    tracer = Tracer()
+    run = _overlapping_run(tracer)
+
+    steps = [(span.name, on_path) for depth, span, on_path in tracer.critical_path(run) if depth == 2]
+
+    assert steps == [("Step 3", 1.0), ("Step 3", 1.0), ("Step 3", 1.0), ("Step 4", 1.0)]
+
+
+def test_retired_traces_are_dropped():
+    tracer = Tracer(max_runs=2)
+    for _ in range(5):
+        with tracer.span("run"):
+            with tracer.span("Step 1"):
+                pass
+
+    assert len(tracer.traces) == 2
+    assert len(tracer.get_runs()) == 2
@@ -0,0 +1,40 @@
+from src.tracing import Tracer
+from src.workers import process_job
+
+
+class StubRewriter:
+    """Just enough of TweetRewriter for process_job; the second draft fails"""
+    def __init__(self):
+        self.tracer = Tracer()
+        self.drafts = 0
+        self.gated = []
+
+    def get_intents(self):
+        return []
+
+    def extract_facts(self, original_text, intent):
+        return "facts"
+
+    def select_persona(self, intent_id=None):
+        return {"name": f"persona {self.drafts + 1}"}
+
+    def generate_draft(self, persona, facts, intent_obj=None):
+        self.drafts += 1
+        if self.drafts == 2:
+            raise RuntimeError("provider 500")
+        return f"draft {self.drafts}"
+
+    def quality_gate_batch(self, items, variation_spans=None):
+        self.gated.extend(draft for _, draft in items)
+        return [f"[PASSED] (Score: 90) {draft}" for _, draft in items]
+
+
+def test_failed_variation_is_recorded_and_the_rest_still_run():
+    rewriter = StubRewriter()
+
+    results = process_job(rewriter, {"original_text": "tweet", "intent": "hype", "count": 3})
+
+    assert rewriter.gated == ["draft 1", "draft 3"]
+    assert results[0] == {"persona": "persona 1", "draft": "draft 1", "final": "[PASSED] (Score: 90) draft 1"}
+    assert results[1] == {"persona": "persona 2", "error": "provider 500"}
+    assert results[2]["final"] == "[PASSED] (Score: 90) draft 3"
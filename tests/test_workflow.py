@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from src.workflow import TweetRewriter
+
+PERSONA = {"name": "Type A (Trader): The Fomo Guy", "description": "Chases pumps"}
+DRAFT = "staking is live, 12% apy"
+
+
+class FakeClient:
+    def __init__(self, response):
+        self.response = response
+        self.last_usage = {"input_tokens": 10, "output_tokens": 5}
+        self.calls = 0
+
+    def generate(self, prompt, system_instruction="", json_mode=False):
+        self.calls += 1
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+
+def _rewriter(monkeypatch, primary, secondary=None, refinement=False):
+    config = {
+        "tracing": {"enabled": False},
+        "step1_extraction": {"fingerprint": {"enabled": False}},
+        "step4_refinement": {
+            "threshold_score": 85,
+            "primary": {"provider": "fake", "model": "primary"},
+            "refinement": {"enabled": True, **refinement} if isinstance(refinement, dict) else {"enabled": refinement}
+        }
+    }
+    clients = {"primary": primary}
+    if secondary is not None:
+        config["step4_refinement"]["secondary"] = {"provider": "fake", "model": "secondary"}
+        clients["secondary"] = secondary
+    rewriter = TweetRewriter(config)
+    monkeypatch.setattr(rewriter, "_create_client", lambda section: clients[section["model"]])
+    return rewriter
+
+
+@pytest.mark.parametrize("refinement", [False, True])
+@pytest.mark.parametrize("bad_result", [
+    {"score": "abc", "rewritten_tweet": "x"},
+    {"rewritten_tweet": "x"},
+    {"score": None},
+    ["not", "an", "object"]
+])
+def test_invalid_score_falls_back_to_secondary(monkeypatch, bad_result, refinement):
+    primary = FakeClient(json.dumps(bad_result))
+    secondary = FakeClient(json.dumps({"score": 92, "rewritten_tweet": "x"}))
+    rewriter = _rewriter(monkeypatch, primary, secondary, refinement)
+
+    assert rewriter.quality_gate(PERSONA, DRAFT) == f"[PASSED] (Score: 92) {DRAFT}"
+    assert secondary.calls == 1
+
+
+def test_invalid_score_without_secondary_is_an_error_not_a_crash(monkeypatch):
+    rewriter = _rewriter(monkeypatch, FakeClient(json.dumps({"score": "high"})))
+
+    assert rewriter.quality_gate(PERSONA, DRAFT).startswith("[ERROR]")
+
+
+def test_numeric_string_score_is_coerced(monkeypatch):
+    rewriter = _rewriter(monkeypatch, FakeClient(json.dumps({"score": "90"})))
+
+    assert rewriter.quality_gate(PERSONA, DRAFT) == f"[PASSED] (Score: 90) {DRAFT}"
+
+
+def test_refinement_that_never_passes_is_reported_as_budget_exhausted(monkeypatch):
+    rewriter = _rewriter(monkeypatch, FakeClient(json.dumps({"score": 60, "rewritten_tweet": "still meh"})), refinement={"max_rounds": 2})
+
+    output = rewriter.quality_gate(PERSONA, DRAFT)
+
+    # Best scored candidate, flagged as a failure rather than passed off as a rewrite
+    assert output == f"[BUDGET_EXHAUSTED] (Score: 60) {DRAFT}"
+    assert rewriter.get_refinement_records()[-1]["outcome"] == "budget_exhausted"
+
+
+class ScriptedClient(FakeClient):
+    """Returns one response per call and keeps the prompts it was sent"""
+    def __init__(self, responses):
+        super().__init__(None)
+        self.responses = list(responses)
+        self.prompts = []
+
+    def generate(self, prompt, system_instruction="", json_mode=False):
+        self.prompts.append(prompt)
+        self.calls += 1
+        return json.dumps(self.responses.pop(0))
+
+
+def test_locally_failing_candidate_is_only_rewritten_not_scored(monkeypatch):
+    client = ScriptedClient([
+        {"rewritten_tweet": "staking live, 12% apy, aping in"},
+        {"score": 90, "rewritten_tweet": "staking live, 12% apy, aping in"}
+    ])
+    rewriter = _rewriter(monkeypatch, client, refinement={"max_rounds": 3})
+
+    output = rewriter.quality_gate(PERSONA, "Staking will revolutionize yields: 12% APY #crypto")
+
+    assert output == "[REWRITTEN] (Score: 90) staking live, 12% apy, aping in"
+    assert "do NOT score it" in client.prompts[0] and "Banned word: revolutionize" in client.prompts[0]
+    assert '"score"' in client.prompts[1]
+    assert rewriter.get_refinement_records()[-1]["scores"] == [None, 90]